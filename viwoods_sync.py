@@ -11,45 +11,205 @@ FIXED: Uses correct 3-step download process:
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import argparse
+import os
+import filecmp
+from collections import Counter
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import atexit
 import hashlib
 import sqlite3
+import threading
+
+# Stored checksums are prefixed with HASH_NAME so each row says which algorithm made it
+try:
+    # Optional: BLAKE3 hashes much faster than anything in hashlib
+    from blake3 import blake3 as new_hasher
+    HASH_NAME = 'blake3'
+except ImportError:
+    new_hasher = hashlib.blake2b
+    HASH_NAME = 'blake2b'
+
+# Number of files downloaded in parallel (each download is network-bound)
+DOWNLOAD_WORKERS = 8
+
+# Number of folder listings fetched in parallel while walking the tree
+LIST_WORKERS = 4
+
+# Bytes read from the network per write; large chunks keep the copy loop cheap
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+
+# Files at least this large are fetched as parallel byte ranges when supported
+RANGE_DOWNLOAD_THRESHOLD = 2 * 1024 * 1024
+RANGE_DOWNLOAD_PARTS = 4
+
+# Interrupted downloads are kept this long for resuming, then cleaned up
+PART_MAX_AGE_DAYS = 7
+
+# Ranged downloads record their progress at least this often, for resuming
+RANGE_CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# Most requests in flight at once: folder listings plus ranged downloads
+HTTP_POOL_SIZE = LIST_WORKERS + DOWNLOAD_WORKERS * RANGE_DOWNLOAD_PARTS
+
+# Listing keys that may carry a file's size. The getChildFolderList format is
+# undocumented and these names are unconfirmed; when neither is present, untracked
+# local files are simply downloaded again.
+LISTING_SIZE_KEYS = ('fileSize', 'size')
+
+# Listing updateTime values above this are epoch milliseconds rather than seconds
+MILLISECOND_TIMESTAMP_MIN = 10 ** 11
+
+# Synced rows buffered before they are written in a single transaction
+SYNC_FLUSH_ROWS = 32
 
 class ViwoodsSync:
-    def __init__(self, ip: str = "192.168.0.130", port: int = 8090, local_dir: str = "./viwoods_sync"):
+    # Statements run during the sync, defined in one place. sqlite3's statement
+    # cache is keyed on the SQL text, so repeated calls reuse the prepared form.
+    # Range scan on the primary key; LIKE would treat '_' in app types as a wildcard
+    _SYNCED_STATE_SQL = '''
+        SELECT file_path, update_time, etag, last_modified
+        FROM synced_files
+        WHERE file_path >= ? AND file_path < ?
+    '''
+    _UPSERT_SQL = '''
+        INSERT OR REPLACE INTO synced_files
+        (file_path, note_id, update_time, file_size, last_sync, checksum,
+         etag, last_modified, local_path)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    # Rows hashed with another algorithm (or MD5, before checksums were tagged)
+    # can't be compared by digest, so they match on size and the byte compare decides
+    _DUPLICATES_SQL = '''
+        SELECT local_path FROM synced_files
+        WHERE file_size = ? AND (checksum = ? OR checksum NOT LIKE ?)
+          AND local_path IS NOT NULL AND local_path != ?
+        ORDER BY checksum = ? DESC
+    '''
+    _MARK_UNCHANGED_SQL = '''
+        UPDATE synced_files SET update_time = ?, last_sync = ?
+        WHERE file_path = ?
+    '''
+    _SYNCED_FOLDERS_SQL = '''
+        SELECT folder_id, last_update_time, files FROM synced_folders WHERE app_type = ?
+    '''
+    _UPSERT_FOLDER_SQL = '''
+        INSERT OR REPLACE INTO synced_folders
+        (app_type, folder_id, last_update_time, files)
+        VALUES (?, ?, ?, ?)
+    '''
+
+    def __init__(self, ip: str = "192.168.0.130", port: int = 8090, local_dir: str = "./viwoods_sync",
+                 force: bool = False, prune_folders: bool = False):
         self.base_url = f"http://{ip}:{port}"
+        # Force mode re-downloads everything, even files that look intact locally
+        self.force = force
+        # Skip walking folders whose updateTime hasn't changed (see sync_folder_recursive)
+        self.prune_folders = prune_folders
         self.session = requests.Session()
+        # Keep-alive pool with a connection for every request that can be in
+        # flight at once, so no worker ever has to open a fresh socket
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount('http://', adapter)
         self.local_dir = Path(local_dir)
         self.local_dir.mkdir(exist_ok=True)
 
-        # SQLite database to track synced files
+        # Folder listings already fetched this run, keyed by (app_type, name, id)
+        self._folder_cache = {}
+
+        # Whether the tablet answers conditional GETs (None until observed)
+        self.conditional_get = None
+
+        # Set when a sync is interrupted so in-flight downloads stop early
+        self.interrupted = threading.Event()
+
+        # SQLite database to track synced files (one connection held for the run)
         self.db_path = self.local_dir / ".sync_db.sqlite"
+        self.db_lock = threading.Lock()
+        self.conn = None
+        self._pending = []
+        self._pending_unchanged = []
+        self._pending_folders = []
         self.init_database()
+        atexit.register(self.close)
 
     def init_database(self):
-        """Initialize SQLite database to track synced files"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS synced_files (
-                file_path TEXT PRIMARY KEY,
-                note_id TEXT,
-                update_time INTEGER,
-                file_size INTEGER,
-                last_sync TEXT,
-                checksum TEXT
-            )
-        ''')
+        """Open the SQLite database and make sure the tracking table exists"""
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None,
+                                    check_same_thread=False)
+
+        with self.db_lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('PRAGMA temp_store=MEMORY')
+            self.conn.execute('PRAGMA cache_size=-64000')
+
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS synced_files (
+                    file_path TEXT PRIMARY KEY,
+                    note_id TEXT,
+                    update_time INTEGER,
+                    file_size INTEGER,
+                    last_sync TEXT,
+                    checksum TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    local_path TEXT
+                )
+            ''')
+
+            # Databases created by older versions lack the HTTP validator columns
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(synced_files)')}
+            for column in ('etag', 'last_modified', 'local_path'):
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE synced_files ADD COLUMN {column} TEXT')
+
+            # Folders whose whole subtree was synced, for pruning unchanged folders
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS synced_folders (
+                    app_type TEXT,
+                    folder_id TEXT,
+                    last_update_time INTEGER,
+                    files TEXT,
+                    PRIMARY KEY (app_type, folder_id)
+                )
+            ''')
+
+            # Older databases lack the per-folder file manifest; such rows are never pruned
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(synced_folders)')}
+            if 'files' not in columns:
+                self.conn.execute('ALTER TABLE synced_folders ADD COLUMN files TEXT')
+
+            # Lets renamed notes be matched to identical content we already have
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_content ON synced_files(file_size, checksum)
+            ''')
+
+    def close(self):
+        """Write any buffered sync records and close the database connection"""
+        if self.conn is not None:
+            self.flush_pending()
 
-        conn.commit()
-        conn.close()
+        with self.db_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
 
     def list_folder(self, app_type: str, folder_name: str, folder_id: str = None):
-        """List contents of a folder"""
+        """List contents of a folder (cached for the lifetime of this syncer)"""
+        items = self.fetch_folder(app_type, folder_name, folder_id)
+        return items if items is not None else []
+
+    def fetch_folder(self, app_type: str, folder_name: str, folder_id: str = None):
+        """Like list_folder, but returns None when the listing failed"""
+        cache_key = (app_type, folder_name, folder_id or '')
+        if cache_key in self._folder_cache:
+            return self._folder_cache[cache_key]
+
         url = f"{self.base_url}/getChildFolderList"
         params = {
             'appType': app_type,
@@ -64,25 +224,44 @@ class ViwoodsSync:
             if response.status_code == 200:
                 data = response.json()
                 if data.get('code') == 200:
-                    return data.get('data', [])
+                    items = data.get('data', [])
+                    self._folder_cache[cache_key] = items
+                    return items
         except Exception as e:
             print(f"Error listing folder: {e}")
-        return []
+        return None
 
     def download_file(self, file_name: str, note_id: str, folder_id: str,
-                     app_type: str, local_path: Path) -> bool:
+                     app_type: str, local_path: Path, validators: tuple = None) -> dict:
         """
         Download a file from Viwoods using the correct 3-step process:
         1. packageFile - get the file path on tablet
         2. /download - actually download the file content
         
         IMPORTANT: note_id is from getChildFolderList, NOT the filename!
+        file_name must already carry its .note extension.
+
+        validators is the (etag, last_modified) recorded for the previous
+        copy of this file. When given, the /download for the freshly packaged
+        file is sent with If-None-Match / If-Modified-Since; a 304 means the
+        local copy is still current and no body is transferred.
+
+        Returns a dict with 'status' ('downloaded', 'linked', 'not_modified'
+        or 'failed') plus 'checksum', 'size', 'etag' and 'last_modified' for
+        the stored copy. The checksum is a BLAKE3 (or BLAKE2b) digest tagged
+        with its algorithm, e.g. 'blake2b:<hex>'. It is computed while
+        streaming for single-stream downloads and by one read of the
+        finished file for ranged ones.
         """
-        # Ensure .note extension
-        if not file_name.endswith('.note'):
-            file_name_with_ext = f"{file_name}.note"
-        else:
-            file_name_with_ext = file_name
+        result = {
+            'status': 'failed',
+            'checksum': None,
+            'size': 0,
+            'etag': None,
+            'last_modified': None
+        }
+
+        download_url = f"{self.base_url}/download"
 
         try:
             # Step 1: packageFile to get the file path on the tablet
@@ -91,7 +270,7 @@ class ViwoodsSync:
                 'appType': app_type,
                 'fileUrl': note_id,  # CRITICAL: This is the noteId, not the filename!
                 'fileFormat': 'note',
-                'fileName': file_name_with_ext,
+                'fileName': file_name,
                 'folderId': folder_id,
                 'isFolder': 'false',
                 'childFileFormat': 'note'
@@ -100,98 +279,469 @@ class ViwoodsSync:
             response = self.session.get(url, params=params, timeout=10)
             
             if response.status_code != 200:
-                return False
+                return result
             
             data = response.json()
             if data.get('code') != 200:
-                return False
+                return result
             
             file_path = data.get('data')
-            if not file_path or not isinstance(file_path, str):
-                return False
+            if not file_path:
+                return result
+
+            # Step 2: Use /download endpoint with the file path to get actual content.
+            # A local copy we already hold is revalidated against the fresh export.
+            headers = self.conditional_headers(validators)
+            response = self.session.get(download_url, params={'filePath': file_path},
+                                        headers=headers, timeout=60, stream=True)
+
+            if response.status_code == 304 and headers:
+                response.close()
+                self.conditional_get = True
+                result['status'] = 'not_modified'
+                return result
 
-            # Step 2: Use /download endpoint with the file path to get actual content
-            download_url = f"{self.base_url}/download"
-            download_params = {'filePath': file_path}
-            
-            response = self.session.get(download_url, params=download_params, timeout=60, stream=True)
-            
             if response.status_code != 200:
-                return False
+                response.close()
+                return result
 
-            # Ensure parent directory exists
-            local_path.parent.mkdir(parents=True, exist_ok=True)
+            # Same ETag served in full: the tablet ignores conditional headers
+            etag = headers.get('If-None-Match')
+            if self.conditional_get is None and etag and response.headers.get('ETag') == etag:
+                self.conditional_get = False
 
-            # Write file
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            download_params = {'filePath': file_path}
+            result['etag'] = response.headers.get('ETag')
+            result['last_modified'] = response.headers.get('Last-Modified')
+
+            content_length = int(response.headers.get('Content-Length') or 0)
+
+            # Bytes land in a .part file that only replaces local_path once complete,
+            # so an interrupted download never looks like a synced file
+            tmp_path = self.partial_path(local_path, result['etag'], result['last_modified'],
+                                         content_length)
+            accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+            # Resume an interrupted download of this same version of the file. A
+            # single-stream .part's length is the real progress (writes truncate it on
+            # every exit). A ranged .part is preallocated to full length and resumed by
+            # download_ranges from its progress file instead.
+            resume_from = 0
+            if accepts_ranges and (result['etag'] or result['last_modified']):
+                try:
+                    resume_from = tmp_path.stat().st_size
+                except OSError:
+                    resume_from = 0
+
+                if 0 < resume_from < content_length:
+                    response.close()
+                    response = self.session.get(download_url, params=download_params, timeout=60,
+                                                stream=True, headers={'Range': f'bytes={resume_from}-'})
+                    # Only append if the server sends the tail of this exact file
+                    content_range = response.headers.get('Content-Range', '')
+                    if (response.status_code != 206 or
+                            not content_range.startswith(f'bytes {resume_from}-') or
+                            not content_range.endswith(f'/{content_length}')):
+                        response.close()
+                        resume_from = 0
+                        response = self.session.get(download_url, params=download_params,
+                                                    timeout=60, stream=True)
+                        if response.status_code != 200:
+                            response.close()
+                            return result
+                else:
+                    resume_from = 0
+
+            # Large files: fetch byte ranges over several connections instead
+            if (not resume_from and content_length >= RANGE_DOWNLOAD_THRESHOLD and
+                    accepts_ranges):
+                response.close()
+                if self.download_ranges(download_url, download_params, tmp_path, content_length):
+                    # Parts arrive out of order, so hash the finished file in one pass
+                    hasher = new_hasher()
+                    with open(tmp_path, 'rb') as f:
+                        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                            hasher.update(block)
+
+                    result['checksum'] = f"{HASH_NAME}:{hasher.hexdigest()}"
+                    result['size'] = content_length
+                    result['status'] = self.finish_download(tmp_path, local_path,
+                                                            result['size'], result['checksum'])
+                    return result
+
+                # Ranges that were served and checkpointed are kept for the next run
+                # rather than thrown away by starting over on a single stream
+                try:
+                    checkpointed = self.progress_path(tmp_path).stat().st_size > 0
+                except OSError:
+                    checkpointed = False
+                if checkpointed or self.interrupted.is_set():
+                    return result
+
+                # Fall back to a single stream
+                response = self.session.get(download_url, params=download_params, timeout=60, stream=True)
+                if response.status_code != 200:
+                    response.close()
+                    return result
+
+            # Write file, hashing each chunk as it goes past
+            hasher = new_hasher()
+            bytes_written = resume_from
+            if resume_from:
+                # The digest has to cover the bytes already on disk
+                with open(tmp_path, 'rb') as f:
+                    for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        hasher.update(block)
+
+            if not resume_from:
+                # Rewriting from scratch invalidates any ranged progress for this .part
+                self.progress_path(tmp_path).unlink(missing_ok=True)
+
+            with open(tmp_path, 'ab' if resume_from else 'wb') as f:
+                try:
+                    # Reserve space up front so the file can be laid out contiguously
+                    if not resume_from and content_length > 0 and hasattr(os, 'posix_fallocate'):
+                        try:
+                            os.posix_fallocate(f.fileno(), 0, content_length)
+                        except OSError:
+                            pass
+
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if self.interrupted.is_set():
+                            # Keep the .part for the next run to resume
+                            response.close()
+                            return result
+                        if chunk:
+                            hasher.update(chunk)
+                            f.write(chunk)
+                            bytes_written += len(chunk)
+                finally:
+                    # Drop any preallocated space the server didn't fill, including when
+                    # the transfer dies part way, so the file length is the real progress
+                    f.truncate(bytes_written)
             
+            # A connection that closes early can end the stream without an error
+            # (urllib3 1.x doesn't enforce Content-Length), so check the length here.
+            # A short .part is kept for the next run to resume; an overlong one is junk.
+            if content_length and bytes_written != content_length:
+                if bytes_written > content_length:
+                    tmp_path.unlink()
+                return result
+
             # Verify we got something
-            if local_path.stat().st_size == 0:
-                local_path.unlink()
-                return False
-                
-            return True
+            if bytes_written == 0:
+                tmp_path.unlink()
+                return result
+
+            result['checksum'] = f"{HASH_NAME}:{hasher.hexdigest()}"
+            result['size'] = bytes_written
+            result['status'] = self.finish_download(tmp_path, local_path,
+                                                    result['size'], result['checksum'])
+            return result
             
         except Exception as e:
-            return False
+            return result
+
+    def conditional_headers(self, validators: tuple = None) -> dict:
+        """Build If-None-Match / If-Modified-Since headers from recorded validators"""
+        headers = {}
+        if not validators or self.conditional_get is False:
+            return headers
+
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def duplicate_candidates(self, size: int, checksum: str, local_path: Path) -> list:
+        """
+        Return local paths of synced files with the given size and checksum
+        (or a checksum from another algorithm) stored somewhere other than
+        local_path, exact checksum matches first
+        """
+        with self.db_lock:
+            rows = self.conn.execute(self._DUPLICATES_SQL,
+                                     (size, checksum, f"{HASH_NAME}:%",
+                                      self.relative_path(local_path), checksum)).fetchall()
+        return [row[0] for row in rows]
+
+    def finish_download(self, tmp_path: Path, local_path: Path, size: int,
+                        checksum: str) -> str:
+        """
+        Move a completed .part file into place. When an identical file is
+        already synced elsewhere (e.g. the note was renamed or moved), the
+        new copy is replaced by a hardlink to it instead.
+
+        Returns 'linked' or 'downloaded'.
+        """
+        for candidate_path in self.duplicate_candidates(size, checksum, local_path):
+            source = self.local_dir / candidate_path
+            try:
+                # The recorded checksum may be stale; only link proven-identical bytes
+                if not filecmp.cmp(tmp_path, source, shallow=False):
+                    continue
+                link_path = tmp_path.with_suffix('.link.part')
+                link_path.unlink(missing_ok=True)
+                os.link(source, link_path)
+                os.replace(link_path, local_path)
+            except OSError:
+                continue
+            tmp_path.unlink()
+            return 'linked'
+
+        os.replace(tmp_path, local_path)
+        return 'downloaded'
+
+    def partial_path(self, local_path: Path, etag: str, last_modified: str,
+                     size: int) -> Path:
+        """
+        Name of the in-progress download for one version of a file. The
+        version is part of the name so a resume never appends to bytes from
+        an older copy.
+        """
+        version = hashlib.blake2b(f"{etag}|{last_modified}|{size}".encode(),
+                                  digest_size=4).hexdigest()
+        return local_path.with_name(f"{local_path.name}.{version}.part")
+
+    def clean_partial_files(self, max_age_days: int = PART_MAX_AGE_DAYS):
+        """Delete .part files left by downloads interrupted more than max_age_days ago"""
+        cutoff = datetime.now().timestamp() - max_age_days * 86400
+
+        for dir_path, _, file_names in os.walk(self.local_dir):
+            for file_name in file_names:
+                if not file_name.endswith('.part'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def relative_path(self, local_path: Path) -> str:
+        """Path of a synced file relative to the sync directory, as stored in the database"""
+        return str(local_path.relative_to(self.local_dir))
+
+    def progress_path(self, tmp_path: Path) -> Path:
+        """Sidecar recording how much of each byte range of a .part file is on disk"""
+        return tmp_path.with_suffix('.progress.part')
+
+    def download_ranges(self, download_url: str, download_params: dict,
+                        local_path: Path, size: int) -> bool:
+        """
+        Download a file as RANGE_DOWNLOAD_PARTS parallel byte ranges.
 
-    def calculate_checksum(self, file_path: Path) -> str:
-        """Calculate MD5 checksum of a file"""
-        md5 = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                md5.update(chunk)
-        return md5.hexdigest()
+        Each range checkpoints its progress to a sidecar file (see
+        progress_path) once the bytes are flushed to disk, so an interrupted
+        download only refetches what it hasn't got yet.
+        """
+        part_size = -(-size // RANGE_DOWNLOAD_PARTS)
+        ranges = [(lo, min(lo + part_size, size) - 1) for lo in range(0, size, part_size)]
 
-    def is_file_synced(self, remote_path: str, update_time: int) -> bool:
-        """Check if file is already synced and up to date"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Checkpoints from an earlier run: one "lo hi offset" line each, appended as
+        # ranges progress. They only count for a .part preallocated to this size.
+        progress_path = self.progress_path(local_path)
+        progress = {}
+        try:
+            if local_path.stat().st_size == size:
+                with open(progress_path) as f:
+                    for line in f:
+                        try:
+                            lo, hi, offset = map(int, line.split())
+                        except ValueError:
+                            continue  # torn write from a killed run
+                        progress[lo, hi] = max(offset, progress.get((lo, hi), lo))
+        except OSError:
+            progress = {}
+
+        if not progress:
+            progress_path.unlink(missing_ok=True)
+            with open(local_path, 'wb') as f:
+                f.truncate(size)
+
+        progress_lock = threading.Lock()
+
+        def fetch(progress_file, lo: int, hi: int) -> bool:
+            start = progress.get((lo, hi), lo)
+            if start > hi:
+                return True
+
+            response = self.session.get(download_url, params=download_params, timeout=60,
+                                        stream=True, headers={'Range': f'bytes={start}-{hi}'})
+            # The server must confirm it is sending exactly the range we asked for
+            content_range = response.headers.get('Content-Range', '')
+            if (response.status_code != 206 or
+                    not content_range.startswith(f'bytes {start}-{hi}/') or
+                    not content_range.endswith(f'/{size}')):
+                response.close()
+                return False
 
-        cursor.execute('''
-            SELECT update_time FROM synced_files WHERE file_path = ?
-        ''', (remote_path,))
+            offset = checkpoint = start
+            with open(local_path, 'r+b') as f:
+                f.seek(start)
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if self.interrupted.is_set():
+                        response.close()
+                        return False
+                    if offset + len(chunk) > hi + 1:
+                        # More bytes than the range holds; never write into the next part
+                        response.close()
+                        return False
+                    if chunk:
+                        f.write(chunk)
+                        offset += len(chunk)
+
+                    if offset - checkpoint >= RANGE_CHECKPOINT_BYTES or offset == hi + 1:
+                        # The bytes must be on disk before the checkpoint vouches for them
+                        f.flush()
+                        os.fsync(f.fileno())
+                        with progress_lock:
+                            progress_file.write(f"{lo} {hi} {offset}\n")
+                            progress_file.flush()
+                        checkpoint = offset
+            return offset == hi + 1
 
-        result = cursor.fetchone()
-        conn.close()
+        try:
+            with open(progress_path, 'a') as progress_file, \
+                    ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                results = list(executor.map(lambda r: fetch(progress_file, *r), ranges))
+        except Exception:
+            return False
 
-        if result:
-            return result[0] >= update_time
+        if all(results):
+            progress_path.unlink(missing_ok=True)
+            return True
         return False
 
+    def get_synced_state(self, prefix: str) -> dict:
+        """
+        Return {file_path: (update_time, etag, last_modified)}
+        for every synced file under a prefix
+        """
+        with self.db_lock:
+            rows = self.conn.execute(self._SYNCED_STATE_SQL,
+                                     (prefix, prefix + '\uffff')).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
     def record_sync(self, remote_path: str, note_id: str, update_time: int,
-                    file_size: int, local_path: Path):
-        """Record a successful sync in the database"""
-        checksum = self.calculate_checksum(local_path)
+                    file_size: int, local_path: Path, checksum: str = None,
+                    etag: str = None, last_modified: str = None):
+        """Queue a successful sync to be written by the next flush_pending()"""
         now = datetime.now().isoformat()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self._pending.append((remote_path, note_id, update_time, file_size, now, checksum,
+                              etag, last_modified, self.relative_path(local_path)))
 
-        cursor.execute('''
-            INSERT OR REPLACE INTO synced_files
-            (file_path, note_id, update_time, file_size, last_sync, checksum)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (remote_path, note_id, update_time, file_size, now, checksum))
+    def get_synced_folders(self, app_type: str) -> dict:
+        """
+        Return {folder_id: (last_update_time, files)} for fully synced folders
+        of an app type, where files is the JSON manifest of the subtree
+        """
+        with self.db_lock:
+            rows = self.conn.execute(self._SYNCED_FOLDERS_SQL, (app_type,)).fetchall()
+        return {row[0]: row[1:] for row in rows}
 
-        conn.commit()
-        conn.close()
+    def record_folder(self, app_type: str, folder_id: str, update_time: int, files: list):
+        """
+        Queue a folder whose whole subtree synced, with the local paths of
+        every file in that subtree; written by the next flush_pending()
+        """
+        self._pending_folders.append((app_type, folder_id, update_time, json.dumps(files)))
 
-    def sync_folder_recursive(self, app_type: str, folder_name: str, folder_id: str,
-                             local_path: Path, path_stack: list, stats: dict):
-        """Recursively sync a folder and all its contents"""
+    def folder_manifest(self, known_folder: tuple, update_time: int):
+        """
+        Return the recorded file manifest of a folder that can be pruned: one
+        whose updateTime hasn't moved and whose files are all still on disk.
+        Returns None when the folder has to be walked.
+        """
+        if not known_folder or not update_time:
+            return None
+
+        last_update_time, files = known_folder
+        if files is None or last_update_time < update_time:
+            return None
+
+        files = json.loads(files)
+        local_dir_str = str(self.local_dir)
+        if not all(os.path.exists(os.path.join(local_dir_str, path)) for path in files):
+            return None
+        return files
+
+    def flush_pending(self):
+        """Write all queued sync records in one transaction"""
+        if not (self._pending or self._pending_unchanged or self._pending_folders):
+            return
+
+        with self.db_lock:
+            # IMMEDIATE takes the write lock up front instead of upgrading mid-batch
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany(self._UPSERT_SQL, self._pending)
+                self.conn.executemany(self._MARK_UNCHANGED_SQL, self._pending_unchanged)
+                # Folders go in the same transaction as the files they vouch for
+                self.conn.executemany(self._UPSERT_FOLDER_SQL, self._pending_folders)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        self._pending.clear()
+        self._pending_unchanged.clear()
+        self._pending_folders.clear()
+
+    def mark_unchanged(self, remote_path: str, update_time: int):
+        """Queue a file the tablet confirmed is unchanged (HTTP 304) for the next flush"""
+        now = datetime.now().isoformat()
+
+        self._pending_unchanged.append((update_time, now, remote_path))
+
+    def written_since(self, local_stat: os.stat_result, update_time: int) -> bool:
+        """Whether a local file was last written at or after a listing updateTime"""
+        if not update_time:
+            return False
+        if update_time >= MILLISECOND_TIMESTAMP_MIN:
+            return local_stat.st_mtime * 1000 >= update_time
+        return local_stat.st_mtime >= update_time
+
+    def scan_folder(self, app_type: str, folder_name: str, folder_id: str,
+                    local_path: Path, preloaded_items: list = None) -> tuple:
+        """
+        List one folder and sort its contents into work for the walker.
+
+        Returns (subfolders, downloads, cached, verified) where subfolders
+        are (name, folder_id, update_time) tuples, downloads are the
+        arguments needed to fetch and record each new or changed file,
+        cached are (file_name, size) pairs for files that are already up to
+        date, and verified are the record_sync arguments for untracked local
+        files whose size matches the listing and whose mtime is no older than
+        the listed updateTime.
+        Returns None if the folder couldn't be listed.
+        """
+        subfolders = []
+        downloads = []
+        cached_files = []
+        verified_files = []
 
         # Create local directory
         local_path.mkdir(parents=True, exist_ok=True)
 
-        # Get folder contents
-        items = self.list_folder(app_type, folder_name, folder_id)
+        # Get folder contents (the caller may already have listed it)
+        if preloaded_items is not None:
+            items = preloaded_items
+        else:
+            items = self.fetch_folder(app_type, folder_name, folder_id)
 
+        if items is None:
+            return None
         if not items:
-            return
+            return subfolders, downloads, cached_files, verified_files
+
+        # One query for the sync state of every file in this folder
+        synced = self.get_synced_state(f"{app_type}/{folder_id}/")
+
+        # Plain string paths in the per-item loop; Path objects only for downloads
+        local_dir_str = str(local_path)
 
         for item in items:
             item_name = item.get('fileName', 'Unknown')
@@ -200,43 +750,230 @@ class ViwoodsSync:
             update_time = item.get('updateTime', 0)
 
             if is_folder:
-                # Recursively sync subfolder
-                stats['folders'] += 1
-                print(f"📁 {'/'.join(path_stack)}/{item_name}")
-
-                self.sync_folder_recursive(
-                    app_type,
-                    item_name,
-                    note_id,
-                    local_path / item_name,
-                    path_stack + [item_name],
-                    stats
-                )
+                subfolders.append((item_name, note_id, update_time))
             else:
                 # Sync file
                 file_name = item_name if item_name.endswith('.note') else f"{item_name}.note"
-                local_file_path = local_path / file_name
 
                 # Build a unique identifier for tracking
                 remote_identifier = f"{app_type}/{folder_id}/{note_id}/{file_name}"
 
-                if self.is_file_synced(remote_identifier, update_time) and local_file_path.exists():
-                    file_size = local_file_path.stat().st_size
-                    print(f"  ⊙ {file_name} ({file_size:,} bytes - cached)")
-                    stats['skipped'] += 1
+                state = synced.get(remote_identifier)
+                try:
+                    local_stat = os.stat(os.path.join(local_dir_str, file_name))
+                    local_size = local_stat.st_size
+                except OSError:
+                    local_stat = local_size = None
+
+                # Size from the listing, when the tablet reports one
+                remote_size = next((item[key] for key in LISTING_SIZE_KEYS if key in item), None)
+
+                if state and state[0] >= update_time and local_size is not None:
+                    cached_files.append((file_name, local_size))
+                elif (not state and not self.force and local_size is not None and
+                        remote_size is not None and local_size == remote_size and
+                        self.written_since(local_stat, update_time)):
+                    # Untracked file already on disk with the listed size, written no
+                    # earlier than the tablet's last change (e.g. the database was
+                    # lost): adopt it instead of downloading it again
+                    verified_files.append((remote_identifier, note_id, update_time,
+                                           local_size, local_path / file_name))
                 else:
-                    print(f"  ↓ {file_name}", end='', flush=True)
-
-                    if self.download_file(item_name, note_id, folder_id, app_type, local_file_path):
-                        file_size = local_file_path.stat().st_size
-                        
-                        self.record_sync(remote_identifier, note_id, update_time,
-                                       file_size, local_file_path)
-                        print(f" → ✓ {file_size:,} bytes")
-                        stats['downloaded'] += 1
+                    # A local copy with recorded validators can be checked with a conditional GET
+                    validators = state[1:] if state and local_size is not None else None
+                    downloads.append((file_name, note_id, folder_id, app_type,
+                                      local_path / file_name, remote_identifier, update_time,
+                                      validators))
+
+        return subfolders, downloads, cached_files, verified_files
+
+    def sync_folder_recursive(self, app_type: str, folder_name: str, folder_id: str,
+                             local_path: Path, path_stack: list, stats: Counter,
+                             preloaded_items: list = None):
+        """
+        Sync a folder and all its contents.
+
+        Folders are listed breadth-first on one thread pool and files are
+        downloaded on another, so many listings and downloads are in flight
+        at once. Results are handled on this thread only, which keeps the
+        stats and database writes single-threaded.
+
+        With prune_folders set, subfolders whose updateTime hasn't moved
+        since their last complete sync, and whose recorded files are all
+        still on disk, are not walked at all. This relies on the tablet
+        bumping a folder's updateTime whenever anything below it changes,
+        which the tablet's API doesn't document, so it is opt-in. A folder
+        counts as complete once its listing, every download in it and every
+        subfolder below it succeeded. Without prune_folders no file manifests
+        are built or stored, so the first pruning run walks everything.
+        """
+        known_folders = self.get_synced_folders(app_type) if self.prune_folders else {}
+
+        def new_node(parent, folder_key):
+            node = {'parent': parent, 'outstanding': 1, 'failed': False,
+                    'key': folder_key, 'files': []}
+            if parent is not None:
+                parent['outstanding'] += 1
+            return node
+
+        def finish_task(node, failed=False):
+            # Walk up the tree closing every folder whose work is all done
+            while node is not None:
+                node['failed'] |= failed
+                node['outstanding'] -= 1
+                if node['outstanding']:
+                    return
+                if self.prune_folders:
+                    if not node['failed'] and node['key']:
+                        self.record_folder(app_type, *node['key'], node['files'])
+                    if node['parent'] is not None:
+                        node['parent']['files'].extend(node['files'])
+                failed = node['failed']
+                node = node['parent']
+
+        def handle_download(task, result):
+            _, node, note_id, local_file_path, remote_identifier, update_time, file_label = task
+
+            if result['status'] in ('downloaded', 'linked'):
+                self.record_sync(remote_identifier, note_id, update_time,
+                                 result['size'], local_file_path, result['checksum'],
+                                 result['etag'], result['last_modified'])
+                if result['status'] == 'linked':
+                    print(f"  ↓ {file_label} → ✓ {result['size']:,} bytes (linked to identical copy)")
+                    stats['linked'] += 1
+                else:
+                    print(f"  ↓ {file_label} → ✓ {result['size']:,} bytes")
+                    stats['downloaded'] += 1
+
+                if self.prune_folders:
+                    node['files'].append(self.relative_path(local_file_path))
+
+                if len(self._pending) >= SYNC_FLUSH_ROWS:
+                    self.flush_pending()
+            elif result['status'] == 'not_modified':
+                self.mark_unchanged(remote_identifier, update_time)
+                if self.prune_folders:
+                    node['files'].append(self.relative_path(local_file_path))
+                print(f"  ⊙ {file_label} (not modified)")
+                stats['skipped'] += 1
+            else:
+                print(f"  ↓ {file_label} → ✗ failed")
+                stats['failed'] += 1
+
+            finish_task(node, failed=result['status'] == 'failed')
+
+        # Pools are shut down by hand: leaving a with block waits for every
+        # queued download, which would keep an interrupted sync running
+        list_pool = ThreadPoolExecutor(max_workers=LIST_WORKERS)
+        download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+        self.interrupted.clear()
+
+        # Maps each in-flight future to its folder (scans) or download
+        # details (downloads); each carries the folder node it belongs to
+        root = new_node(None, None)
+        pending = {
+            list_pool.submit(self.scan_folder, app_type, folder_name, folder_id,
+                             local_path, preloaded_items): ('scan', root, local_path, path_stack)
+        }
+
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    task = pending.pop(future)
+
+                    if task[0] == 'scan':
+                        _, node, folder_path, folder_stack = task
+                        scan = future.result()
+                        if scan is None:
+                            print(f"  ✗ could not list {'/'.join(folder_stack)}")
+                            finish_task(node, failed=True)
+                            continue
+
+                        subfolders, downloads, cached_files, verified_files = scan
+                        folder_label = '/'.join(folder_stack)
+
+                        # The header goes out with the folder's own results; the root
+                        # folder is announced by the caller
+                        if node is not root:
+                            print(f"📁 {folder_label}")
+
+                        # Folders unchanged and intact since their last complete sync are pruned
+                        pruned = {}
+                        for sub_name, sub_id, sub_update_time in subfolders:
+                            manifest = self.folder_manifest(known_folders.get(sub_id),
+                                                            sub_update_time)
+                            if manifest is not None:
+                                pruned[sub_id] = manifest
+
+                        # One counter update per folder rather than per item
+                        stats.update({'skipped': len(cached_files) + len(verified_files),
+                                      'verified': len(verified_files),
+                                      'folders': len(subfolders) - len(pruned),
+                                      'folders_skipped': len(pruned)})
+
+                        for file_name, file_size in cached_files:
+                            print(f"  ⊙ {file_name} ({file_size:,} bytes - cached)")
+
+                        for (remote_identifier, note_id, update_time,
+                             file_size, local_file_path) in verified_files:
+                            self.record_sync(remote_identifier, note_id, update_time,
+                                             file_size, local_file_path)
+                            print(f"  ⊙ {local_file_path.name} ({file_size:,} bytes - size matches)")
+
+                        if self.prune_folders:
+                            # Manifest of the folder's files, checked before pruning it next time
+                            folder_relative = self.relative_path(folder_path)
+                            node['files'].extend(os.path.join(folder_relative, file_name)
+                                                 for file_name, _ in cached_files)
+                            node['files'].extend(self.relative_path(verified[4])
+                                                 for verified in verified_files)
+
+                        if len(self._pending) >= SYNC_FLUSH_ROWS:
+                            self.flush_pending()
+
+                        for sub_name, sub_id, sub_update_time in subfolders:
+                            if sub_id in pruned:
+                                print(f"⊘ {folder_label}/{sub_name} (unchanged)")
+                                node['files'].extend(pruned[sub_id])
+                                continue
+
+                            sub_node = new_node(node, (sub_id, sub_update_time))
+                            sub_future = list_pool.submit(self.scan_folder, app_type, sub_name,
+                                                          sub_id, folder_path / sub_name)
+                            pending[sub_future] = ('scan', sub_node, folder_path / sub_name,
+                                                   folder_stack + [sub_name])
+
+                        for (file_name, note_id, file_folder_id, file_app_type,
+                             local_file_path, remote_identifier, update_time,
+                             validators) in downloads:
+                            node['outstanding'] += 1
+                            download_future = download_pool.submit(
+                                self.download_file, file_name, note_id, file_folder_id,
+                                file_app_type, local_file_path, validators)
+                            # Downloads finish in any order, so their lines name the folder
+                            pending[download_future] = ('download', node, note_id, local_file_path,
+                                                        remote_identifier, update_time,
+                                                        f"{folder_label}/{file_name}")
+
+                        finish_task(node)
                     else:
-                        print(f" → ✗ failed")
-                        stats['failed'] += 1
+                        handle_download(task, future.result())
+        except BaseException:
+            # Ctrl-C (or an error): drop the queued work instead of finishing it,
+            # stop in-flight downloads at their next chunk, and keep what already landed
+            self.interrupted.set()
+            for future in pending:
+                future.cancel()
+            for future, task in pending.items():
+                if task[0] == 'download' and future.done() and not future.cancelled():
+                    handle_download(task, future.result())
+            raise
+        finally:
+            list_pool.shutdown(wait=False)
+            download_pool.shutdown(wait=False)
+            self.flush_pending()
 
     def sync_all(self, include_all: bool = False):
         """Sync entire Viwoods structure"""
@@ -255,14 +992,10 @@ class ViwoodsSync:
             print(f"Mode: Syncing {', '.join(default_folders)} (use --all for everything)")
         print()
 
-        stats = {
-            'folders': 0,
-            'downloaded': 0,
-            'skipped': 0,
-            'failed': 0
-        }
+        stats = Counter()
 
         start_time = datetime.now()
+        self.clean_partial_files()
 
         # Get root folders
         root_items = self.list_folder('root', 'Home', '')
@@ -289,6 +1022,8 @@ class ViwoodsSync:
                 stats
             )
 
+        self.flush_pending()
+
         # Summary
         elapsed = (datetime.now() - start_time).total_seconds()
 
@@ -296,8 +1031,11 @@ class ViwoodsSync:
         print("✅ Sync Complete!")
         print("=" * 70)
         print(f"Folders processed: {stats['folders']}")
+        print(f"Folders unchanged: {stats['folders_skipped']}")
         print(f"Files downloaded:  {stats['downloaded']}")
+        print(f"Files linked:      {stats['linked']}")
         print(f"Files skipped:     {stats['skipped']}")
+        print(f"  size-verified:   {stats['verified']}")
         print(f"Files failed:      {stats['failed']}")
         print(f"Time elapsed:      {elapsed:.1f}s")
         print(f"\nLocal directory:   {self.local_dir.absolute()}")
@@ -315,12 +1053,8 @@ class ViwoodsSync:
         print(f"🔄 Syncing: {folder_path}")
         print("=" * 70)
 
-        stats = {
-            'folders': 0,
-            'downloaded': 0,
-            'skipped': 0,
-            'failed': 0
-        }
+        stats = Counter()
+        self.clean_partial_files()
 
         # Navigate to the folder
         # First get root to determine app_type
@@ -368,14 +1102,18 @@ class ViwoodsSync:
             current_folder_id or '',
             local_path,
             parts,
-            stats
+            stats,
+            preloaded_items=current_items
         )
+        self.flush_pending()
 
         print("\n" + "=" * 70)
         print("✅ Sync Complete!")
         print("=" * 70)
         print(f"Files downloaded: {stats['downloaded']}")
+        print(f"Files linked:     {stats['linked']}")
         print(f"Files skipped:    {stats['skipped']}")
+        print(f"  size-verified:  {stats['verified']}")
         print(f"Files failed:     {stats['failed']}")
 
 def main():
@@ -396,6 +1134,9 @@ Examples:
   # Sync only a specific folder
   %(prog)s 192.168.0.130 --folder "Paper/Papers/Unclassified Notes"
 
+  # Skip folders the tablet reports as unchanged since the last sync
+  %(prog)s 192.168.0.130 --prune-folders
+
   # Force re-download everything (ignore sync database)
   %(prog)s 192.168.0.130 --force
         """
@@ -408,17 +1149,22 @@ Examples:
     parser.add_argument('--folder', '-f', help='Sync only specific folder (e.g., "Paper/Papers")')
     parser.add_argument('--all', action='store_true',
                        help='Sync ALL folders (default: only Paper, Daily, Meeting, Memo)')
+    parser.add_argument('--prune-folders', action='store_true',
+                       help='Skip folders whose update time is unchanged since the last complete '
+                            'sync (assumes the tablet updates a folder whenever anything inside changes)')
     parser.add_argument('--force', action='store_true',
                        help='Force re-download all files (ignore sync database)')
 
     args = parser.parse_args()
 
     # Create syncer
-    syncer = ViwoodsSync(args.ip, args.port, args.output)
+    syncer = ViwoodsSync(args.ip, args.port, args.output, force=args.force,
+                         prune_folders=args.prune_folders)
 
     # Clear database if force sync
     if args.force:
         print("⚠️  Force mode: clearing sync database")
+        syncer.close()
         syncer.db_path.unlink(missing_ok=True)
         syncer.init_database()
 